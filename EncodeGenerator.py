@@ -1,20 +1,264 @@
 import os
 import cv2
+import json
 import pickle
-import tensorflow as tf
-from tensorflow import keras
-keras.layers.LocallyConnected2D = tf.keras.layers.experimental.preprocessing.Resizing
 from deepface import DeepFace
+from deepface.commons import functions
+from sklearn.decomposition import PCA
 import imgaug.augmenters as iaa
 import numpy as np
+import queue
+import threading
 
-def manage_embeddings(db_path="Smart Attendance System/Images", N_AUG=5, emb_path="embeddings.pkl"):
+try:
+    import faiss  # optional: ANN index for large rosters
+except ImportError:
+    faiss = None
+
+# Batch size for the ArcFace forward pass (amortizes per-call TF overhead)
+EMBED_BATCH_SIZE = 64
+
+# How many prepared per-person batches the producer may buffer ahead of the model
+PREFETCH_DEPTH = 4
+
+# Photos whose longest side is still above this after half-resolution decode
+# were big enough (phone camera shots) that the cheap decode is plenty for
+# the detector; smaller ones get re-decoded at full resolution
+REDUCED_MIN_SIDE = 640
+
+# Marks the end of the producer's output stream
+_QUEUE_END = object()
+
+# Memoized ArcFace model shared across manage_embeddings calls
+_model = None
+_model_lock = threading.Lock()
+
+
+def enable_mixed_precision():
+    """Switch Keras to the mixed_float16 policy when a GPU is present.
+
+    Must run before the ArcFace model is built. fp16 compute hits tensor
+    cores and halves activation bandwidth, cutting per-face latency
+    several-fold on GPU; CPU-only hosts keep the fp32 default, where fp16
+    would be slower. Returns True when the policy was applied.
+    """
+    try:
+        import tensorflow as tf
+        if tf.config.list_physical_devices("GPU"):
+            tf.keras.mixed_precision.set_global_policy("mixed_float16")
+            return True
+    except Exception as e:
+        print(f"⚠️ Could not enable mixed-precision inference: {e}")
+    return False
+
+
+def get_model():
+    """Return the process-wide ArcFace model, building it on first use.
+
+    Building the model costs seconds of TF graph construction + weight
+    loading, so it must happen once per process, not once per call.
+    """
+    global _model
+    with _model_lock:
+        if _model is None:
+            enable_mixed_precision()
+            _model = DeepFace.build_model("ArcFace")
+        return _model
+
+
+def warmup():
+    """Eagerly build the ArcFace model (call once at service startup)."""
+    get_model()
+
+# Row width of the ArcFace embeddings stored in the raw matrix file
+EMB_DIM = 512
+
+# Older stores, still read as migration fallbacks
+LEGACY_NPZ_PATH = "embeddings.npz"
+LEGACY_EMB_PATH = "embeddings.pkl"
+
+# PCA projection applied by the recognition path (512-D -> 128-D)
+PCA_COMPONENTS = 128
+PCA_PATH = "gallery_pca.npz"
+
+# FAISS inner-product index over the serving gallery (optional)
+FAISS_INDEX_PATH = "embeddings.faiss"
+FAISS_NAMES_PATH = "embeddings.faiss.names.json"
+
+
+def _index_path(emb_path):
+    """Sidecar JSON with matrix shape and person -> [start, stop) row ranges."""
+    return os.path.splitext(emb_path)[0] + ".index.json"
+
+
+def _load_index(emb_path):
+    path = _index_path(emb_path)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def _write_index(index, emb_path):
+    """Atomically replace the index sidecar (fsync + rename)."""
+    index_path = _index_path(emb_path)
+    tmp_path = index_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(index, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, index_path)
+
+
+def _append_rows(emb_path, rows):
+    """Append new embedding rows to the raw matrix file.
+
+    Prior bytes are never rewritten — adding a student only writes that
+    student's block at the end of the file.
+    """
+    block = np.ascontiguousarray(rows, dtype=np.float32)
+    with open(emb_path, "ab") as f:
+        f.write(block.tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def load_embeddings_db(emb_path="embeddings.dat"):
+    """Load the embeddings store as a {person: [vectors]} dict.
+
+    Prefers the raw memory-mapped matrix + index sidecar; falls back to the
+    packed .npz and then the legacy pickle so existing deployments keep
+    working until their next rebuild.
+    """
+    index = _load_index(emb_path)
+    if index is not None and os.path.exists(emb_path) and index.get("rows"):
+        dim = index.get("dim", EMB_DIM)
+        emb = np.memmap(emb_path, dtype=np.float32, mode="r").reshape(-1, dim)
+        return {
+            person: [np.asarray(emb[i], dtype=np.float32) for i in range(start, stop)]
+            for person, (start, stop) in index["people"].items()
+        }
+    if os.path.exists(LEGACY_NPZ_PATH):
+        data = np.load(LEGACY_NPZ_PATH, mmap_mode="r", allow_pickle=True)
+        embeddings = {}
+        for row, name in zip(data["emb"], data["names"]):
+            embeddings.setdefault(str(name), []).append(np.asarray(row, dtype=np.float32))
+        return embeddings
+    if os.path.exists(LEGACY_EMB_PATH):
+        with open(LEGACY_EMB_PATH, "rb") as f:
+            return pickle.load(f)
+    return None
+
+
+def save_embeddings_db(embeddings, emb_path="embeddings.dat"):
+    """Full rewrite of the matrix file + index.
+
+    Only needed for the one-time migration from a legacy store and for
+    compaction after students are removed; incremental adds go through
+    _append_rows instead.
+    """
+    rows, index = [], {"dim": EMB_DIM, "rows": 0, "people": {}}
+    for person, vecs in embeddings.items():
+        start = len(rows)
+        rows.extend(np.asarray(v, dtype=np.float32) for v in vecs)
+        index["people"][person] = [start, len(rows)]
+    index["rows"] = len(rows)
+
+    tmp_path = emb_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        if rows:
+            f.write(np.vstack(rows).astype(np.float32).tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, emb_path)
+    _write_index(index, emb_path)
+
+
+def update_pca_projection(embeddings, pca_path=PCA_PATH):
+    """Fit a 512-D -> 128-D PCA on the stored embeddings and persist the
+    projection (components + mean) for the recognition path.
+
+    Matching against 128-D vectors moves a quarter of the memory the full
+    512-D gallery does; main.load_gallery applies the same projection to
+    stored rows and live queries. Skipped while the roster is too small to
+    fit that many components.
+    """
+    rows = [np.asarray(v, dtype=np.float32) for vecs in embeddings.values() for v in vecs]
+    if len(rows) < PCA_COMPONENTS:
+        print(f"⏩ Skipping PCA projection ({len(rows)} embeddings < {PCA_COMPONENTS} components).")
+        return
+
+    pca = PCA(n_components=PCA_COMPONENTS).fit(np.vstack(rows))
+
+    tmp_path = pca_path + ".tmp.npz"
+    np.savez(
+        tmp_path,
+        components=pca.components_.astype(np.float32),
+        mean=pca.mean_.astype(np.float32),
+    )
+    os.replace(tmp_path, pca_path)
+    print(f"📐 PCA projection updated ({PCA_COMPONENTS} components).")
+
+
+def update_faiss_index(embeddings, index_path=FAISS_INDEX_PATH, names_path=FAISS_NAMES_PATH):
+    """Build an exact inner-product FAISS index over the serving gallery.
+
+    Applies the same transform the recognition path uses (PCA projection
+    when available, then L2 normalization) so index scores equal the
+    matmul cosine scores. No-op when faiss isn't installed — main.py
+    falls back to the brute-force matmul.
+    """
+    if faiss is None:
+        print("⏩ Skipping FAISS index (faiss not installed).")
+        return
+
+    names, rows = [], []
+    for person, vecs in embeddings.items():
+        for v in vecs:
+            rows.append(np.asarray(v, dtype=np.float32))
+            names.append(person)
+    if not rows:
+        return
+
+    E = np.vstack(rows)
+    if os.path.exists(PCA_PATH):
+        pca_data = np.load(PCA_PATH)
+        E = (E - pca_data["mean"].astype(np.float32)) @ pca_data["components"].astype(np.float32).T
+    E /= (np.linalg.norm(E, axis=1, keepdims=True) + 1e-12)
+
+    index = faiss.IndexFlatIP(E.shape[1])
+    index.add(np.ascontiguousarray(E, dtype=np.float32))
+
+    tmp_path = index_path + ".tmp"
+    faiss.write_index(index, tmp_path)
+    os.replace(tmp_path, index_path)
+
+    tmp_names = names_path + ".tmp"
+    with open(tmp_names, "w") as f:
+        json.dump(names, f)
+    os.replace(tmp_names, names_path)
+    print(f"🔎 FAISS index updated ({index.ntotal} vectors, dim {index.d}).")
+
+
+def manage_embeddings(db_path="Smart Attendance System/Images", N_AUG=5, emb_path="embeddings.dat"):
     """
     This function manages face embeddings:
-    - If embeddings.pkl does not exist, it creates embeddings for all students.
-    - If embeddings.pkl exists, it only updates by adding embeddings for new students.
+    - If the store does not exist, it creates embeddings for all students.
+    - If the store exists, it only updates by adding embeddings for new students.
+
+    All face crops for a person (originals + augmentations) are collected first
+    and embedded in a single batched forward pass through the ArcFace model,
+    instead of one DeepFace.represent call per image.
+
+    Image decode + augmentation (CPU) run in a producer thread that feeds a
+    bounded queue of per-person batches, so disk and prep work overlap with
+    the model's forward passes instead of running back to back.
     """
 
+    # Reuse the process-wide ArcFace model (built once, memoized)
+    model = get_model()
+    target_size = functions.find_target_size(model_name="ArcFace")
+
     # Augmentation pipeline
     augmenter = iaa.Sequential([
         iaa.Fliplr(0.5),                     # horizontal flip
@@ -26,34 +270,35 @@ def manage_embeddings(db_path="Smart Attendance System/Images", N_AUG=5, emb_pat
     ])
 
     # Load existing embeddings if available
-    if os.path.exists(emb_path):
-        with open(emb_path, "rb") as f:
-            embeddings = pickle.load(f)
+    embeddings = load_embeddings_db(emb_path)
+    if embeddings is not None:
         print("📂 Loaded existing embeddings.")
     else:
         embeddings = {}
         print("🆕 Starting fresh embeddings database.")
 
-    def save_temp_image(image, temp_path="temp_aug.jpg"):
-        """Helper function: save augmented image temporarily to disk"""
-        cv2.imwrite(temp_path, image)
-        return temp_path
+    # Migrate legacy stores to the raw matrix file once; afterwards new
+    # students are appended without touching existing bytes
+    index = _load_index(emb_path)
+    if index is None or not os.path.exists(emb_path):
+        save_embeddings_db(embeddings, emb_path)
+        index = _load_index(emb_path)
 
-    # Loop through each student folder 
-    for person in os.listdir(db_path):
-        person_path = os.path.join(db_path, person)
-        if not os.path.isdir(person_path):
-            continue
+    # One directory scan drives both the add and remove passes; scandir's
+    # dirents make the is_dir check free of an extra stat per entry
+    with os.scandir(db_path) as it:
+        current_students = {entry.name for entry in it if entry.is_dir()}
 
-        # Skip if already in embeddings
-        if person in embeddings:
-            print(f"⏩ Skipping {person} (already encoded).")
-            continue
+    for person in sorted(current_students & embeddings.keys()):
+        print(f"⏩ Skipping {person} (already encoded).")
+    new_persons = sorted(current_students - embeddings.keys())
 
-        print(f"\n🔄 Processing new person: {person}")
-        embeddings[person] = []
+    def prepare_person(person):
+        """Decode, align and augment all of one person's photos (CPU work).
+        Returns a (B, H, W, 3) float32 batch or None if nothing usable."""
+        person_path = os.path.join(db_path, person)
+        faces = []
 
-        # Loop through each image of the student 
         for img in os.listdir(person_path):
             if not img.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp', '.tiff')):
                 continue
@@ -61,51 +306,108 @@ def manage_embeddings(db_path="Smart Attendance System/Images", N_AUG=5, emb_pat
             img_path = os.path.join(person_path, img)
 
             try:
-                # Generate embedding for the original image
-                rep = DeepFace.represent(img_path=img_path, model_name="ArcFace", enforce_detection=False)
-                embeddings[person].append(rep[0]["embedding"])
-                print(f"  ✅ Original processed: {img}")
-
-                # Augmentation and embedding 
-                face_img = cv2.imread(img_path)
-                if face_img is None:
+                # Decode at half resolution first: libjpeg scales in the DCT
+                # domain, skipping most IDCT work on 12 MP phone photos that
+                # the detector would immediately downsample anyway
+                img_arr = cv2.imread(img_path, cv2.IMREAD_REDUCED_COLOR_2)
+                if img_arr is not None and max(img_arr.shape[:2]) < REDUCED_MIN_SIDE:
+                    img_arr = cv2.imread(img_path)
+                if img_arr is None:
                     print(f"  ⚠️ Could not read image: {img}")
                     continue
 
-                face_img_rgb = cv2.cvtColor(face_img, cv2.COLOR_BGR2RGB)
+                # Detect + align once per photo; augmentations reuse this crop,
+                # so the detector never runs on augmented copies
+                face_objs = functions.extract_faces(
+                    img=img_arr, target_size=target_size,
+                    detector_backend="opencv", enforce_detection=False, align=True
+                )
+                aligned = face_objs[0][0][0]
+                faces.append(aligned)
+                print(f"  ✅ Original processed: {img}")
+
+                # Augment the aligned crop directly (imgaug works on uint8);
+                # one vectorized call produces all N_AUG variants at once
+                if N_AUG > 0:
+                    aligned_u8 = (aligned * 255).astype(np.uint8)
+                    aug_batch = augmenter(images=np.stack([aligned_u8] * N_AUG, axis=0))
+                    faces.extend(np.asarray(aug_batch, dtype=np.float32) / 255.0)
+                    print(f"  ✅ {N_AUG} augmentations prepared")
 
-                for i in range(N_AUG):
-                    # Apply augmentation
-                    aug_img_rgb = augmenter(image=face_img_rgb)
-                    aug_img_bgr = cv2.cvtColor(aug_img_rgb, cv2.COLOR_RGB2BGR)
+            except Exception as e:
+                print(f"  ❌ Skipping {img_path}: {e}")
 
+        return np.stack(faces).astype(np.float32) if faces else None
 
-                    # Generate embedding for augmented image
-                    aug_rep = DeepFace.represent(img_path=aug_img_bgr, model_name="ArcFace", enforce_detection=False)
-                    embeddings[person].append(aug_rep[0]["embedding"])
+    # Producer thread prepares batches ahead while the model embeds the
+    # previous person; the bounded queue caps memory use
+    batch_queue = queue.Queue(maxsize=PREFETCH_DEPTH)
 
-                
-                    print(f"  ✅ Augmentation {i+1}/{N_AUG} processed")
+    def producer():
+        # The sentinel must reach the consumer even if a person blows up
+        # outside prepare_person's per-image handling, or the consume
+        # loop below would block forever
+        try:
+            for person in new_persons:
+                print(f"\n🔄 Processing new person: {person}")
+                try:
+                    batch = prepare_person(person)
+                except Exception as e:
+                    print(f"  ❌ Skipping {person}: {e}")
+                    batch = None
+                batch_queue.put((person, batch))
+        finally:
+            batch_queue.put(_QUEUE_END)
 
-            except Exception as e:
-                print(f"  ❌ Skipping {img_path}: {e}")
+    threading.Thread(target=producer, daemon=True).start()
+
+    while True:
+        item = batch_queue.get()
+        if item is _QUEUE_END:
+            break
+        person, batch = item
+
+        # One batched forward pass for all of this person's crops
+        embeddings[person] = []
+        if batch is not None:
+            embs = model.predict(batch, batch_size=EMBED_BATCH_SIZE, verbose=0)
+            embeddings[person].extend(np.asarray(row, dtype=np.float32) for row in embs)
+
+        # Append this person's block to the store right away; only the new
+        # rows and the small index sidecar get written
+        if embeddings[person]:
+            start = index["rows"]
+            _append_rows(emb_path, np.vstack(embeddings[person]))
+            index["people"][person] = [start, start + len(embeddings[person])]
+            index["rows"] = start + len(embeddings[person])
+            _write_index(index, emb_path)
 
         print(f"📊 Total embeddings for {person}: {len(embeddings[person])}")
 
-    # Remove embeddings of students no longer in folder
-    current_students = set(os.listdir(db_path))
-    to_remove = [name for name in embeddings if name not in current_students]
+    # Remove embeddings of students no longer in folder (reuses the scan
+    # from the top instead of re-listing the directory)
+    to_remove = sorted(embeddings.keys() - current_students)
 
     for name in to_remove:
         del embeddings[name]
         print(f"🗑️ Removed old student embeddings: {name}")
 
-    # Save updated embeddings 
-    with open(emb_path, "wb") as f:
-        pickle.dump(embeddings, f)
+    # Compaction (full rewrite) only happens when students were removed;
+    # plain additions were already flushed incrementally above
+    if to_remove:
+        save_embeddings_db(embeddings, emb_path)
+
+    # Refresh the recognition-side artifacts on the updated roster;
+    # the flat gallery must be rebuilt here too, or the serving loader
+    # would keep preferring a stale gallery.npy after enrollment changes
+    update_pca_projection(embeddings)
+    update_faiss_index(embeddings)
+    from build_gallery import build_gallery
+    build_gallery()
 
     print("\n✅ Embeddings updated & saved.")
     total_embeddings = sum(len(v) for v in embeddings.values())
     print(f"📈 Final Summary: {len(embeddings)} people, {total_embeddings} embeddings total.")
 
-manage_embeddings(N_AUG=1)
\ No newline at end of file
+if __name__ == "__main__":
+    manage_embeddings(N_AUG=1)
@@ -11,11 +11,16 @@ from flask import jsonify
 import time
 from firebase_config import get_firebase_manager
 import threading
+from collections import Counter
 
 # ---------------------------------------------------------
 # Concurrent per-class session state (thread-safe)
 # ---------------------------------------------------------
-_sessions_lock = threading.RLock()
+# One lock per class (striped locking): frame uploads for different
+# classrooms never contend with each other. _locks_meta only guards the
+# tiny lazy creation of a class's lock.
+_locks_meta = threading.Lock()
+_locks = {}
 _sessions_by_class = {}
 """
 _sessions_by_class structure:
@@ -30,37 +35,56 @@ _sessions_by_class structure:
 """
 
 
-def start_session(class_id: str, session_name: str = None):
-    """Start a new manual session for a specific class (concurrent-safe)."""
+def _lock_for(class_id):
+    """Return the lock for one class, creating it lazily."""
+    with _locks_meta:
+        return _locks.setdefault(class_id, threading.Lock())
+
+
+def _start_session_core(class_id: str, session_name: str = None):
+    """Start a new manual session for a specific class (concurrent-safe).
+
+    Core form: returns a plain dict; only the Flask wrapper serializes.
+    """
     if not class_id:
-        return jsonify({"status": "error", "message": "class_id is required"}), 400
-    with _sessions_lock:
+        return {"status": "error", "message": "class_id is required"}
+    with _lock_for(class_id):
         sess = _sessions_by_class.get(class_id)
         if sess and sess.get("is_active"):
-            return jsonify({"status": "already_active", "class_id": class_id}), 409
+            return {"status": "already_active", "class_id": class_id}
         _sessions_by_class[class_id] = {
             "is_active": True,
             "session_name": session_name or f"{class_id}_session",
-            "attendance_records": {},
+            "attendance_records": Counter(),
             "start_time": datetime.now(),
         }
         s = _sessions_by_class[class_id]
-        return jsonify({
+        return {
             "status": "started",
             "class_id": class_id,
             "session_name": s["session_name"],
             "start_time": s["start_time"].isoformat()
-        })
+        }
 
 
-def stop_session(class_id: str):
-    """Stop the session for a specific class and return summary."""
+def start_session(class_id: str, session_name: str = None):
+    """Flask wrapper around _start_session_core."""
+    result = _start_session_core(class_id, session_name)
+    if result["status"] == "error":
+        return jsonify(result), 400
+    if result["status"] == "already_active":
+        return jsonify(result), 409
+    return jsonify(result)
+
+
+def _stop_session_core(class_id: str):
+    """Stop the session for a specific class and return its summary dict."""
     if not class_id:
-        return jsonify({"status": "error", "message": "class_id is required"}), 400
-    with _sessions_lock:
+        return {"status": "error", "message": "class_id is required"}
+    with _lock_for(class_id):
         sess = _sessions_by_class.get(class_id)
         if not sess or not sess.get("is_active"):
-            return jsonify({"status": "inactive", "message": "No active session."}), 400
+            return {"status": "inactive", "message": "No active session."}
         end_time = datetime.now()
         start_time = sess.get("start_time")
         duration_seconds = int((end_time - start_time).total_seconds()) if start_time else 0
@@ -78,25 +102,41 @@ def stop_session(class_id: str):
         _sessions_by_class[class_id] = {
             "is_active": False,
             "session_name": None,
-            "attendance_records": {},
+            "attendance_records": Counter(),
             "start_time": None,
         }
-        return jsonify(summary)
+        return summary
 
 
-def get_session_status(class_id: str):
-    """Return whether a class session is currently active."""
+def stop_session(class_id: str):
+    """Flask wrapper around _stop_session_core."""
+    result = _stop_session_core(class_id)
+    if result.get("status") in ("error", "inactive"):
+        return jsonify(result), 400
+    return jsonify(result)
+
+
+def _get_session_status_core(class_id: str):
+    """Return whether a class session is currently active, as a dict."""
     if not class_id:
-        return jsonify({"status": "error", "message": "class_id is required"}), 400
-    with _sessions_lock:
+        return {"status": "error", "message": "class_id is required"}
+    with _lock_for(class_id):
         sess = _sessions_by_class.get(class_id) or {}
         st = sess.get("start_time")
-        return jsonify({
+        return {
             "session_active": bool(sess.get("is_active")),
             "session_name": sess.get("session_name"),
             "class_id": class_id,
             "start_time": st.isoformat() if st else None
-        })
+        }
+
+
+def get_session_status(class_id: str):
+    """Flask wrapper around _get_session_status_core."""
+    result = _get_session_status_core(class_id)
+    if result.get("status") == "error":
+        return jsonify(result), 400
+    return jsonify(result)
 
 
 def list_scheduled_sessions():
@@ -123,25 +163,39 @@ def record_recognition_results(recognized_names):
     return jsonify({"status": "error", "message": "class_id required"}), 400
 
 
-def record_recognition_results_for_class(recognized_names, class_id: str):
-    """Update attendance for a specific class session."""
+def _record_recognition_results_core(recognized_names, class_id: str):
+    """Update attendance for a specific class session; returns a dict.
+
+    Counts are kept in a collections.Counter and updated in one C-level
+    call; the response carries only the number of counted names — pollers
+    that want the full records use get_current_session_data instead of
+    re-serializing the whole dict on every frame.
+    """
     if not class_id:
-        return jsonify({"status": "error", "message": "class_id is required"}), 400
-    with _sessions_lock:
+        return {"status": "error", "message": "class_id is required"}
+    names = [name for name in recognized_names if name != "Unknown"]
+    with _lock_for(class_id):
         sess = _sessions_by_class.get(class_id)
         if not sess or not sess.get("is_active"):
-            return jsonify({"status": "inactive", "message": "No active session."}), 403
-        records = sess.setdefault("attendance_records", {})
-        for name in recognized_names:
-            if name != "Unknown":
-                records[name] = records.get(name, 0) + 1
-        return jsonify({"status": "recorded", "updated": records})
+            return {"status": "inactive", "message": "No active session."}
+        sess.setdefault("attendance_records", Counter()).update(names)
+        return {"status": "recorded", "n": len(names)}
+
+
+def record_recognition_results_for_class(recognized_names, class_id: str):
+    """Flask wrapper around _record_recognition_results_core."""
+    result = _record_recognition_results_core(recognized_names, class_id)
+    if result["status"] == "error":
+        return jsonify(result), 400
+    if result["status"] == "inactive":
+        return jsonify(result), 403
+    return jsonify(result)
 
 def get_current_session_data(class_id: str):
     """Get session data for a specific class."""
     if not class_id:
         return None
-    with _sessions_lock:
+    with _lock_for(class_id):
         sess = _sessions_by_class.get(class_id)
         if not sess:
             return None
@@ -155,13 +209,15 @@ def get_current_session_data(class_id: str):
 
 def clear_session_data(class_id: str = None):
     """Clear session data for a class or all."""
-    with _sessions_lock:
-        if class_id:
+    if class_id:
+        with _lock_for(class_id):
             _sessions_by_class[class_id] = {
                 "is_active": False,
                 "session_name": None,
-                "attendance_records": {},
+                "attendance_records": Counter(),
                 "start_time": None,
             }
-        else:
+    else:
+        # Admin/global reset (rare path): only needs the meta lock
+        with _locks_meta:
             _sessions_by_class.clear()
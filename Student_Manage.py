@@ -1,11 +1,46 @@
 import os
 import shutil
 import base64
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from flask import jsonify, request
 
 # Base directory for student images
 STUDENTS_DIR = "Smart Attendance System/Images"
 
+# Workers for parallel image writes (enrollment can be 20-50 photos)
+WRITE_WORKERS = 8
+
+
+def _write_images_parallel(student_folder, student_name, image_bytes_list):
+    """
+    Write image bytes to disk concurrently so a large enrollment upload
+    doesn't serialize N file writes on the Flask worker.
+    Returns (saved_count, first_error) where first_error is (idx, exception)
+    or None if everything succeeded.
+    """
+
+    def write_one(idx, img_bytes):
+        filename = os.path.join(student_folder, f"{student_name}_{idx+1}.jpg")
+        with open(filename, "wb") as f:
+            f.write(img_bytes)
+
+    saved_count = 0
+    first_error = None
+    with ThreadPoolExecutor(max_workers=WRITE_WORKERS) as executor:
+        futures = {
+            executor.submit(write_one, idx, img_bytes): idx
+            for idx, img_bytes in enumerate(image_bytes_list)
+        }
+        for future in as_completed(futures):
+            exc = future.exception()
+            if exc is not None:
+                if first_error is None:
+                    first_error = (futures[future], exc)
+            else:
+                saved_count += 1
+
+    return saved_count, first_error
+
 
 def add_student_from_api(student_name, image_data_list):
     """
@@ -13,6 +48,30 @@ def add_student_from_api(student_name, image_data_list):
     Used when images are captured from frontend (browser camera).
     """
 
+    image_bytes_list = []
+    for idx, img_data in enumerate(image_data_list):
+        try:
+            # Remove 'data:image/jpeg;base64,' prefix if present
+            if "," in img_data:
+                img_data = img_data.split(",")[1]
+
+            image_bytes_list.append(base64.b64decode(img_data))
+        except Exception as e:
+            return jsonify({
+                "status": "error",
+                "message": f"Failed to save image {idx+1}: {str(e)}"
+            }), 500
+
+    return add_student_from_bytes(student_name, image_bytes_list)
+
+
+def add_student_from_bytes(student_name, image_bytes_list):
+    """
+    Create a student folder and save raw image bytes directly.
+    Used for multipart uploads where the payload is already binary,
+    skipping the base64 encode/decode round-trip.
+    """
+
     student_name = student_name.strip().replace(" ", "_")
     student_folder = os.path.join(STUDENTS_DIR, student_name)
 
@@ -29,24 +88,15 @@ def add_student_from_api(student_name, image_data_list):
 
     os.makedirs(student_folder)
 
-    saved_count = 0
-    for idx, img_data in enumerate(image_data_list):
-        try:
-            # Remove 'data:image/jpeg;base64,' prefix if present
-            if "," in img_data:
-                img_data = img_data.split(",")[1]
-
-            img_bytes = base64.b64decode(img_data)
-            filename = os.path.join(student_folder, f"{student_name}_{idx+1}.jpg")
-
-            with open(filename, "wb") as f:
-                f.write(img_bytes)
-            saved_count += 1
-        except Exception as e:
-            return jsonify({
-                "status": "error",
-                "message": f"Failed to save image {idx+1}: {str(e)}"
-            }), 500
+    saved_count, first_error = _write_images_parallel(
+        student_folder, student_name, image_bytes_list
+    )
+    if first_error is not None:
+        idx, exc = first_error
+        return jsonify({
+            "status": "error",
+            "message": f"Failed to save image {idx+1}: {str(exc)}"
+        }), 500
 
     return jsonify({
         "status": "success",
@@ -2,57 +2,25 @@ import os
 import io
 import json
 import base64
-import tempfile
 import traceback
 import subprocess
 import sys
+import cv2
+import numpy as np
 from datetime import datetime
 from flask import Flask, request, jsonify, send_file
 from flask_cors import CORS
-from firebase_config import get_firebase_manager, initialize_firebase
-import main  
-import Run as scheduler_module  
-import Student_Manage as student_manage  
-import ast
-
-def safe_load_manage_embeddings(module_path="EncodeGenerator.py"):
-    """
-    Read the source of module_path, parse it, extract the manage_embeddings
-    function object without executing top-level calls (like manage_embeddings()).
-    Returns the function object or raises.
-    """
-    if not os.path.exists(module_path):
-        raise FileNotFoundError(f"{module_path} not found")
-
-    source = open(module_path, "r", encoding="utf-8").read()
-    parsed = ast.parse(source, filename=module_path)
-
-    # Build a new AST that contains only the function def for manage_embeddings
-    new_body = []
-    for node in parsed.body:
-        # Keep function def named 'manage_embeddings' and necessary imports
-        if isinstance(node, ast.Import) or isinstance(node, ast.ImportFrom):
-            new_body.append(node)
-        elif isinstance(node, ast.FunctionDef) and node.name == "manage_embeddings":
-            new_body.append(node)
-
-    new_module = ast.Module(body=new_body, type_ignores=[])
-    ast.fix_missing_locations(new_module)
-
-    # Compile and exec in a fresh namespace
-    namespace = {}
-    compiled = compile(new_module, module_path, "exec")
-    exec(compiled, namespace)
-    if "manage_embeddings" not in namespace:
-        raise RuntimeError("manage_embeddings function not found in module")
-    return namespace["manage_embeddings"]
-
+from firebase_config import get_firebase_manager, get_async_firebase_manager, initialize_firebase, run_async
+import main
+import Run as scheduler_module
+import Student_Manage as student_manage
 
 try:
-    manage_embeddings = safe_load_manage_embeddings("EncodeGenerator.py")
+    from EncodeGenerator import manage_embeddings, warmup
+    warmup()  # build the ArcFace model once, before the first request
 except Exception as e:
     manage_embeddings = None
-    print("⚠️ Warning: could not load manage_embeddings safely:", str(e))
+    print("⚠️ Warning: could not load manage_embeddings:", str(e))
     print(traceback.format_exc())
 
 
@@ -77,32 +45,17 @@ os.makedirs(BASE_DIR, exist_ok=True)
 
 
 def decode_base64_image(data_b64):
-    """Return bytes for base64 image string (may include data:image/... prefix)."""
-    if "," in data_b64:
-        data_b64 = data_b64.split(",")[1]
-    return base64.b64decode(data_b64)
-
-def save_temp_image_bytes(bytes_data, suffix=".jpg"):
-    """Save bytes to a temp file path and return the path (caller should remove)."""
-    tmp = tempfile.NamedTemporaryFile(delete=False, suffix=suffix)
-    tmp.write(bytes_data)
-    tmp.flush()
-    tmp.close()
-    return tmp.name
-
-def parse_recognize_response(flask_response):
-    """
-    Given a Flask Response returned by main.recognize_faces_from_image (which uses jsonify),
-    parse and return the JSON object.
-    """
-    try:
-        data = flask_response.get_data(as_text=True)
-        return json.loads(data)
-    except Exception:
-        return {"status": "error", "message": "Failed to parse recognition response"}
-
+    """Return bytes for base64 image string (may include data:image/... prefix).
 
+    partition avoids split's list-of-copies allocation for large payloads,
+    and the non-validating b64decode is measurably faster.
+    """
+    head, sep, tail = data_b64.partition(",")
+    return base64.b64decode(tail if sep else head, validate=False)
 
+def decode_image_bytes(bytes_data):
+    """Decode raw image bytes straight into a BGR ndarray (no disk round-trip)."""
+    return cv2.imdecode(np.frombuffer(bytes_data, np.uint8), cv2.IMREAD_COLOR)
 
 @app.route("/", methods=["GET"])
 def home():
@@ -116,6 +69,7 @@ def home():
             "DELETE /remove_student/<name>": "Remove student",
             "POST /update_embeddings": "Rebuild/update embeddings (calls manage_embeddings)",
             "GET /session_status": "Get current session status",
+            "GET /session_records/<class_id>": "Poll full attendance counts for a session",
             "GET /list_students": "List registered students",
             "GET /attendance_files": "List attendance CSV files",
             "POST /start_session": "Start attendance session",
@@ -140,8 +94,12 @@ def start_session():
         
 
         scheduler_module.clear_session_data(class_id)
-        start_resp = scheduler_module.start_session(class_id)
-        return start_resp
+        result = scheduler_module._start_session_core(class_id)
+        if result["status"] == "error":
+            return jsonify(result), 400
+        if result["status"] == "already_active":
+            return jsonify(result), 409
+        return jsonify(result)
         
     except Exception as e:
         return jsonify({"error": f"Failed to start session: {str(e)}"}), 500
@@ -160,32 +118,35 @@ def stop_session():
             return jsonify({"error": "Firebase not initialized"}), 500
         
         
-        stop_resp = scheduler_module.stop_session(class_id)
-        session_data = parse_recognize_response(stop_resp)
-        if not session_data or session_data.get("status") == "inactive":
+        session_data = scheduler_module._stop_session_core(class_id)
+        if not session_data or session_data.get("status") in ("inactive", "error"):
             return jsonify({"error": "No active session found"}), 400
         
         attendance_records = session_data.get('attendance_records', {})
-        success_count = 0
-        
-        for student_name, presence_time in attendance_records.items():
-            session_duration = session_data.get('duration_seconds', 60)
-            attendance_percentage = (presence_time / session_duration) * 100 if session_duration > 0 else 0
-            
-
-            success = firebase_manager.save_attendance_record(
-                class_id=class_id,
-                student_id=student_name,
-                status="present" if attendance_percentage >= 25 else "absent",
-                additional_data={
-                    'presence_time': presence_time,
-                    'attendance_percentage': attendance_percentage,
+        session_duration = max(session_data.get('duration_seconds', 60), 1)
+
+        # Percentages and statuses for the whole class in two array ops,
+        # then one batched Firestore commit instead of a round-trip per
+        # student
+        names = list(attendance_records.keys())
+        times = np.fromiter(attendance_records.values(), dtype=np.float64, count=len(names))
+        pcts = times * (100.0 / session_duration)
+        statuses = np.where(pcts >= 25, "present", "absent")
+
+        records = [
+            {
+                'student_id': name,
+                'status': str(status),
+                'additional_data': {
+                    'presence_time': float(presence_time),
+                    'attendance_percentage': float(pct),
                     'session_duration': session_duration
                 }
-            )
-            
-            if success:
-                success_count += 1
+            }
+            for name, presence_time, pct, status in zip(names, times, pcts, statuses)
+        ]
+
+        success_count = firebase_manager.save_attendance_records_bulk(class_id, records) if records else 0
 
         session_id = f"{class_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
         firebase_manager.save_session_data(
@@ -209,6 +170,26 @@ def stop_session():
     except Exception as e:
         return jsonify({"error": f"Failed to stop session: {str(e)}"}), 500
 
+@app.route("/session_records/<class_id>", methods=["GET"])
+def session_records_route(class_id):
+    """Poll the full attendance counts for a class session.
+
+    /recognize_image responses no longer carry the whole records dict on
+    every frame; dashboards fetch the snapshot here instead.
+    """
+    try:
+        data = scheduler_module.get_current_session_data(class_id)
+        if not data:
+            return jsonify({"error": "No session data for class"}), 404
+
+        start_time = data.get("start_time")
+        data["start_time"] = start_time.isoformat() if start_time else None
+        return jsonify(data)
+
+    except Exception as e:
+        return jsonify({"error": f"Failed to get session records: {str(e)}"}), 500
+
+
 @app.route("/attendance/<class_id>", methods=["GET"])
 def get_attendance_for_class(class_id):
     """Get attendance records for a specific class."""
@@ -217,7 +198,7 @@ def get_attendance_for_class(class_id):
             return jsonify({"error": "Firebase not initialized"}), 500
         
         date = request.args.get('date') 
-        records = firebase_manager.get_attendance_for_class(class_id, date)
+        records = list(firebase_manager.get_attendance_for_class(class_id, date))
         
         return jsonify({
             "classId": class_id,
@@ -231,19 +212,23 @@ def get_attendance_for_class(class_id):
 
 @app.route("/attendance/session/<session_id>", methods=["GET"])
 def get_attendance_for_session(session_id):
-    """Get attendance records for a specific session."""
+    """Get attendance records for a specific session.
+
+    The session document and its per-student attendance records are
+    fetched through the async Firestore client on its dedicated loop
+    thread, so the attendance reads overlap instead of running back to
+    back (the old sync path also fetched the session document twice).
+    """
     try:
         if not firebase_manager:
             return jsonify({"error": "Firebase not initialized"}), 500
-        
-        # Get session data first
-        session = firebase_manager.get_session_data(session_id)
+
+        session, records = run_async(
+            get_async_firebase_manager().get_session_with_attendance(session_id)
+        )
         if not session:
             return jsonify({"error": "Session not found"}), 404
-        
-        # Get attendance records for this session
-        records = firebase_manager.get_attendance_for_session(session_id)
-        
+
         return jsonify({
             "sessionId": session_id,
             "sessionName": session.get('sessionName'),
@@ -266,7 +251,8 @@ def recognize_image_route():
     Accept either:
     - JSON with {"image": "data:image/jpeg;base64,...."} OR
     - multipart/form-data with file input named 'image'
-    Process using main.recognize_faces_from_image (which expects an image path).
+    Decodes the bytes in memory and processes them with
+    main.recognize_faces_from_array — no temp file round-trip.
     If a session is active, record recognized names into scheduler attendance.
     """
     try:
@@ -277,17 +263,14 @@ def recognize_image_route():
             if not image_b64:
                 return jsonify({"status": "error", "message": "No image field in JSON"}), 400
             img_bytes = decode_base64_image(image_b64)
-            tmp_path = save_temp_image_bytes(img_bytes, suffix=".jpg")
         else:
             if "image" not in request.files:
                 return jsonify({"status": "error", "message": "No image file provided"}), 400
-            file = request.files["image"]
-            tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".jpg")
-            file.save(tmp.name)
-            tmp_path = tmp.name
+            img_bytes = request.files["image"].read()
 
-        resp = main.recognize_faces_from_image(tmp_path)
-        result_json = parse_recognize_response(resp)
+        result_json = main.recognize_faces_core(decode_image_bytes(img_bytes))
+        if result_json.get("status") == "error":
+            return jsonify(result_json), 400
 
 
         class_id = None
@@ -308,7 +291,7 @@ def recognize_image_route():
                 if names:
                     if not class_id:
                         return jsonify({"status": "error", "message": "classId is required while a session is active"}), 400
-                    scheduler_module.record_recognition_results_for_class(names, class_id)
+                    scheduler_module._record_recognition_results_core(names, class_id)
         except Exception as e:
             app.logger.error("Failed to record recognition results: %s", str(e))
 
@@ -317,12 +300,6 @@ def recognize_image_route():
     except Exception as e:
         app.logger.error("Error in /recognize_image: %s\n%s", str(e), traceback.format_exc())
         return jsonify({"status": "error", "message": str(e)}), 500
-    finally:
-        try:
-            if 'tmp_path' in locals() and os.path.exists(tmp_path):
-                os.remove(tmp_path)
-        except Exception:
-            pass
 
 
 @app.route("/add_student", methods=["POST"])
@@ -348,12 +325,18 @@ def add_student_route():
             files = request.files.getlist("images")
             if not files and "image" in request.files:
                 files = [request.files["image"]]
+
+            # Uploaded files are already binary — write them as-is instead of
+            # base64-encoding only for add_student_from_api to decode again
+            image_bytes = []
             for file in files:
                 content = file.read()
-                if not content:
-                    continue
-                mime = file.mimetype or "image/jpeg"
-                images_b64.append("data:" + mime + ";base64," + base64.b64encode(content).decode("utf-8"))
+                if content:
+                    image_bytes.append(content)
+
+            if not student_name or not image_bytes:
+                return jsonify({"status": "error", "message": "Missing student_name or images"}), 400
+            return student_manage.add_student_from_bytes(student_name, image_bytes)
         else:
 
             data = request.get_json()
@@ -403,6 +386,7 @@ def update_embeddings_route():
 
         # Call the function (this may take time)
         manage_embeddings(db_path=db_path, N_AUG=n_aug, emb_path=emb_path)
+        main.invalidate_gallery_cache()
         return jsonify({"status": "ok", "message": "Embeddings updated"})
     except Exception as e:
         app.logger.error("update_embeddings error: %s", traceback.format_exc())
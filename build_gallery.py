@@ -0,0 +1,89 @@
+"""
+Build the flat serving gallery from whatever embeddings store exists.
+
+Converts the enrollment store (embeddings.dat / embeddings.npz /
+embeddings.pkl, in that order of preference) into two flat artifacts:
+
+- gallery.npy  — (N, 512) float32 matrix of raw embedding rows
+- names.json   — parallel list of person names
+
+Rows are stored raw (not normalized): load_gallery optionally applies
+the PCA projection fitted on raw embeddings first, then normalizes, so
+the gallery and the query stay in the same space.
+
+main.py prefers these at serving time: np.load(..., mmap_mode='r') gives
+zero-copy, page-cache-backed access to the matrix, so multiple Flask
+workers share one physical copy instead of each unpickling its own
+object graph.
+
+Run after enrollment changes:  python build_gallery.py
+"""
+
+import json
+import os
+
+import numpy as np
+
+try:
+    import orjson  # optional: faster names.json encode/decode
+except ImportError:
+    orjson = None
+
+GALLERY_PATH = "gallery.npy"
+NAMES_PATH = "names.json"
+
+
+def build_gallery(gallery_path=GALLERY_PATH, names_path=NAMES_PATH):
+    """Write gallery.npy + names.json from the current embeddings store.
+
+    Returns the number of gallery rows written (0 when the store is
+    empty). Both files are written to temps and renamed so a reader
+    never sees a half-written artifact.
+    """
+    from EncodeGenerator import load_embeddings_db
+
+    embeddings_db = load_embeddings_db()
+    if not embeddings_db:
+        # Drop any leftover artifacts so the serving loader can't keep
+        # matching against a roster that no longer exists
+        for path in (gallery_path, names_path):
+            if os.path.exists(path):
+                os.remove(path)
+        print("⚠️ No embeddings found — gallery not built")
+        return 0
+
+    names, rows = [], []
+    for person, person_embeddings in embeddings_db.items():
+        for stored_embedding in person_embeddings:
+            rows.append(np.asarray(stored_embedding, dtype=np.float32))
+            names.append(person)
+
+    if not rows:
+        print("⚠️ No embeddings found — gallery not built")
+        return 0
+
+    E = np.vstack(rows)
+
+    tmp_gallery = gallery_path + ".tmp"
+    with open(tmp_gallery, "wb") as f:
+        np.save(f, E)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_gallery, gallery_path)
+
+    tmp_names = names_path + ".tmp"
+    with open(tmp_names, "wb") as f:
+        if orjson is not None:
+            f.write(orjson.dumps(names))
+        else:
+            f.write(json.dumps(names).encode())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_names, names_path)
+
+    print(f"✅ Gallery built: {E.shape[0]} embeddings ({len(set(names))} people) -> {gallery_path}")
+    return E.shape[0]
+
+
+if __name__ == "__main__":
+    build_gallery()
@@ -6,24 +6,68 @@ session management, and student data storage.
 
 import firebase_admin
 from firebase_admin import credentials, firestore
+from google.cloud.firestore_v1.base_query import FieldFilter
 from datetime import datetime
+import asyncio
+import atexit
 import json
 import os
-from typing import Dict, List, Optional, Any
+import queue
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional
+
+# Guards creation of the process-wide manager/client singleton
+_manager_lock = threading.Lock()
+
+
+def _session_date_str(start_time) -> str:
+    """Best-effort YYYY-MM-DD from a session startTime of any stored shape
+    (Firestore Timestamp, datetime, datetime-like, ISO string)."""
+    from firebase_admin import firestore as firestore_module
+
+    if isinstance(start_time, firestore_module.Timestamp):
+        date_obj = start_time.to_datetime() if hasattr(start_time, 'to_datetime') else datetime.fromtimestamp(start_time.timestamp())
+        return date_obj.strftime("%Y-%m-%d")
+    if isinstance(start_time, datetime):
+        return start_time.strftime("%Y-%m-%d")
+    if hasattr(start_time, 'date'):
+        return start_time.date().strftime("%Y-%m-%d")
+    if isinstance(start_time, str):
+        try:
+            return datetime.fromisoformat(start_time.replace('Z', '+00:00')).strftime("%Y-%m-%d")
+        except:
+            pass
+    return datetime.now().strftime("%Y-%m-%d")
 
 class FirebaseManager:
+    """
+    Holds the process-wide Firestore client.
+
+    firestore.Client is thread-safe and keeps its own gRPC channel and
+    connection pool, which are expensive to establish — so exactly one
+    instance should live for the lifetime of the process and be shared by
+    all Flask workers. Use get_firebase_manager()/initialize_firebase()
+    rather than constructing this directly.
+    """
+
     def __init__(self, service_account_path: str = "serviceAccountKey.json"):
         """
         Initialize Firebase Admin SDK.
-        
+
         Args:
             service_account_path: Path to the Firebase service account key JSON file
         """
         self.db = None
         self.initialize_firebase(service_account_path)
-    
+
     def initialize_firebase(self, service_account_path: str):
-        """Initialize Firebase Admin SDK with service account credentials."""
+        """Initialize Firebase Admin SDK with service account credentials.
+
+        Idempotent: once a client exists this returns immediately.
+        """
+        if self.db is not None:
+            return
         try:
             if not firebase_admin._apps:
                 if os.path.exists(service_account_path):
@@ -42,25 +86,36 @@ class FirebaseManager:
         except Exception as e:
             print(f"❌ Error initializing Firebase Admin SDK: {e}")
             raise e
-    
+
+    def close(self):
+        """Release the underlying Firestore client (process shutdown only)."""
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
     def save_attendance_record(self, class_id: str, student_id: str, 
                              status: str = "present", additional_data: Dict = None) -> bool:
         """
-        Save attendance record to Firebase.
-        
+        Queue an attendance record for write-behind persistence.
+
+        The record is appended to an in-process buffer and flushed to
+        Firestore by a background thread in BulkWriter batches, so the
+        caller never blocks on an RPC. Use flush_attendance() (also
+        registered atexit) to force buffered records out.
+
         Args:
             class_id: ID of the class
             student_id: ID of the student
             status: Attendance status (present/absent)
             additional_data: Additional data to store
-            
+
         Returns:
-            bool: True if successful, False otherwise
+            bool: True if buffered, False otherwise
         """
         try:
             today_str = datetime.now().strftime("%Y-%m-%d")
             record_id = f"{class_id}_{student_id}_{today_str}"
-            
+
             attendance_data = {
                 'classId': class_id,
                 'studentId': student_id,
@@ -69,47 +124,121 @@ class FirebaseManager:
                 'timestamp': firestore.SERVER_TIMESTAMP,
                 'createdAt': datetime.now().isoformat()
             }
-            
+
             if additional_data:
                 attendance_data.update(additional_data)
-            
-            self.db.collection('attendance').document(record_id).set(attendance_data, merge=True)
-            print(f"✅ Attendance record saved: {record_id}")
+
+            _ensure_attendance_flusher()
+            _attendance_queue.put((record_id, attendance_data))
             return True
-            
+
         except Exception as e:
-            print(f"❌ Error saving attendance record: {e}")
+            print(f"❌ Error buffering attendance record: {e}")
             return False
     
-    def get_attendance_for_class(self, class_id: str, date: str = None) -> List[Dict]:
+    def save_attendance_records_bulk(self, class_id: str, records: List[Dict]) -> int:
+        """
+        Save many attendance records in one batched Firestore commit.
+
+        Args:
+            class_id: ID of the class
+            records: List of dicts with 'student_id', 'status' and optional
+                'additional_data', mirroring save_attendance_record
+
+        Returns:
+            int: number of records committed (0 on failure)
+        """
+        try:
+            today_str = datetime.now().strftime("%Y-%m-%d")
+            bulk = self.db.bulk_writer()
+            collection = self.db.collection('attendance')
+
+            # Invariant fields built once; each record copies the template
+            # instead of reboxing the same values per student
+            template = {
+                'classId': class_id,
+                'date': today_str,
+                'timestamp': firestore.SERVER_TIMESTAMP,
+                'createdAt': datetime.now().isoformat()
+            }
+
+            for record in records:
+                student_id = record['student_id']
+                record_id = f"{class_id}_{student_id}_{today_str}"
+
+                attendance_data = template.copy()
+                attendance_data.update(
+                    studentId=student_id,
+                    status=record.get('status', 'present')
+                )
+
+                if record.get('additional_data'):
+                    attendance_data.update(record['additional_data'])
+
+                bulk.set(collection.document(record_id), attendance_data, merge=True)
+
+            bulk.close()
+            print(f"✅ Bulk attendance commit: {len(records)} records for class {class_id}")
+            return len(records)
+
+        except Exception as e:
+            print(f"❌ Error saving attendance records in bulk: {e}")
+            return 0
+
+    def _paginate(self, query, page_size: int) -> Iterator[Dict]:
+        """Yield record dicts from a query one cursor page at a time.
+
+        Keeps at most page_size documents in memory regardless of how
+        many records match, instead of materializing the full result.
+        """
+        query = query.order_by('__name__').limit(page_size)
+        cursor = None
+        while True:
+            page = query.start_after(cursor) if cursor is not None else query
+            last = None
+            for doc in page.stream():
+                record = doc.to_dict()
+                record['id'] = doc.id
+                yield record
+                last = doc
+            if last is None:
+                return
+            cursor = last
+
+    def get_attendance_for_class(self, class_id: str, date: str = None,
+                                 page_size: int = 500) -> Iterator[Dict]:
         """
         Get attendance records for a specific class.
-        
+
+        Only the fields callers actually consume are projected with
+        select(), so large optional fields never travel over the wire.
+        Presence/percentage exist under two spellings — camelCase from
+        update_attendance_batch, snake_case from the /stop_session bulk
+        path's additional_data — so both are projected. Requires a
+        composite index on (classId, date) — see the Firestore Indexes
+        note in USAGE_GUIDE.md.
+
         Args:
             class_id: ID of the class
             date: Date in YYYY-MM-DD format (defaults to today)
-            
+            page_size: Documents fetched per cursor page
+
         Returns:
-            List of attendance records
+            Generator of attendance records; wrap with list() if needed
         """
         try:
             if not date:
                 date = datetime.now().strftime("%Y-%m-%d")
-            
-            query = self.db.collection('attendance').where('classId', '==', class_id).where('date', '==', date)
-            docs = query.stream()
-            
-            records = []
-            for doc in docs:
-                record = doc.to_dict()
-                record['id'] = doc.id
-                records.append(record)
-            
-            return records
-            
+
+            query = (self.db.collection('attendance')
+                     .where(filter=FieldFilter('classId', '==', class_id))
+                     .where(filter=FieldFilter('date', '==', date))
+                     .select(['studentId', 'status', 'presenceTime', 'attendancePercentage',
+                              'presence_time', 'attendance_percentage']))
+            yield from self._paginate(query, page_size)
+
         except Exception as e:
             print(f"❌ Error getting attendance records: {e}")
-            return []
     
     def save_session_data(self, session_id: str, session_name: str, 
                          start_time: datetime, end_time: datetime, 
@@ -193,51 +322,34 @@ class FirebaseManager:
             session = self.get_session_data(session_id)
             if not session:
                 return []
-            
+
             class_id = session.get('classId')
             start_time = session.get('startTime')
-            
+
             # Extract date from startTime
             if start_time:
-                from datetime import datetime
-                from firebase_admin import firestore as firestore_module
-                
-                # Handle Firestore Timestamp
-                if isinstance(start_time, firestore_module.Timestamp):
-                    # Firestore Timestamp object - convert to datetime
-                    date_obj = start_time.to_datetime() if hasattr(start_time, 'to_datetime') else datetime.fromtimestamp(start_time.timestamp())
-                    date_str = date_obj.strftime("%Y-%m-%d")
-                elif isinstance(start_time, datetime):
-                    # Python datetime
-                    date_str = start_time.strftime("%Y-%m-%d")
-                elif hasattr(start_time, 'date'):
-                    # Datetime-like object with date() method
-                    date_str = start_time.date().strftime("%Y-%m-%d")
-                elif isinstance(start_time, str):
-                    # String format - try to parse
-                    try:
-                        date_obj = datetime.fromisoformat(start_time.replace('Z', '+00:00'))
-                        date_str = date_obj.strftime("%Y-%m-%d")
-                    except:
-                        date_str = datetime.now().strftime("%Y-%m-%d")
-                else:
-                    # Fallback to current date
-                    date_str = datetime.now().strftime("%Y-%m-%d")
-                # Get attendance for that class and date
-                attendance_records = self.get_attendance_for_class(class_id, date_str)
-                
-                # Filter to only students in this session
+                date_str = _session_date_str(start_time)
                 recognized_students = session.get('recognizedStudents', [])
                 if recognized_students:
-                    # Return attendance for recognized students only
-                    filtered_records = [
-                        record for record in attendance_records
-                        if record.get('studentId') in recognized_students
+                    # Record IDs are deterministic ({classId}_{studentId}_{date}),
+                    # so the recognized students can be fetched with one
+                    # multi-get round-trip instead of streaming the whole
+                    # class query and filtering in Python
+                    refs = [
+                        self.db.collection('attendance').document(f"{class_id}_{student_id}_{date_str}")
+                        for student_id in recognized_students
                     ]
-                    return filtered_records
-                
-                return attendance_records
-            
+                    records = []
+                    for doc in self.db.get_all(refs):
+                        if doc.exists:
+                            record = doc.to_dict()
+                            record['id'] = doc.id
+                            records.append(record)
+                    return records
+
+                # No per-student IDs known — fall back to the class query
+                return list(self.get_attendance_for_class(class_id, date_str))
+
             return []
             
         except Exception as e:
@@ -278,68 +390,71 @@ class FirebaseManager:
             print(f"❌ Error saving student data: {e}")
             return False
     
-    def get_students_for_class(self, class_id: str) -> List[Dict]:
+    def get_students_for_class(self, class_id: str,
+                               page_size: int = 500) -> Iterator[Dict]:
         """
         Get all students for a specific class.
-        
+
         Args:
             class_id: ID of the class
-            
+            page_size: Documents fetched per cursor page
+
         Returns:
-            List of student records
+            Generator of student records; wrap with list() if needed
         """
         try:
-            query = self.db.collection('students').where('classId', '==', class_id)
-            docs = query.stream()
-            
-            students = []
-            for doc in docs:
-                student = doc.to_dict()
-                student['id'] = doc.id
-                students.append(student)
-            
-            return students
-            
+            query = (self.db.collection('students')
+                     .where(filter=FieldFilter('classId', '==', class_id)))
+            yield from self._paginate(query, page_size)
+
         except Exception as e:
             print(f"❌ Error getting students: {e}")
-            return []
     
     def update_attendance_batch(self, class_id: str, attendance_records: Dict[str, Any]) -> bool:
         """
-        Update attendance records in batch.
-        
+        Update attendance records in batch via Firestore's BulkWriter.
+
+        BulkWriter chunks mutations under the 500-op commit limit, sends
+        the commits from parallel worker threads, and retries transient
+        failures with backoff — a single WriteBatch would fail outright
+        above 500 mutations and serialize under one commit.
+
         Args:
             class_id: ID of the class
             attendance_records: Dictionary of student_id -> attendance data
-            
+
         Returns:
             bool: True if successful, False otherwise
         """
         try:
-            batch = self.db.batch()
+            bulk = self.db.bulk_writer()
             today_str = datetime.now().strftime("%Y-%m-%d")
-            
+            collection = self.db.collection('attendance')
+
+            # Invariant fields built once; each record copies the template
+            # instead of reboxing the same values per student
+            template = {
+                'classId': class_id,
+                'date': today_str,
+                'timestamp': firestore.SERVER_TIMESTAMP,
+                'updatedAt': datetime.now().isoformat()
+            }
+
             for student_id, data in attendance_records.items():
-                record_id = f"{class_id}_{student_id}_{today_str}"
-                doc_ref = self.db.collection('attendance').document(record_id)
-                
-                attendance_data = {
-                    'classId': class_id,
-                    'studentId': student_id,
-                    'date': today_str,
-                    'status': data.get('status', 'present'),
-                    'presenceTime': data.get('presence_time', 0),
-                    'attendancePercentage': data.get('attendance_percentage', 0),
-                    'timestamp': firestore.SERVER_TIMESTAMP,
-                    'updatedAt': datetime.now().isoformat()
-                }
-                
-                batch.set(doc_ref, attendance_data, merge=True)
-            
-            batch.commit()
+                attendance_data = template.copy()
+                attendance_data.update(
+                    studentId=student_id,
+                    status=data.get('status', 'present'),
+                    presenceTime=data.get('presence_time', 0),
+                    attendancePercentage=data.get('attendance_percentage', 0)
+                )
+
+                bulk.set(collection.document(f"{class_id}_{student_id}_{today_str}"), attendance_data, merge=True)
+
+            bulk.close()
             print(f"✅ Batch attendance update completed for class {class_id}")
             return True
-            
+
         except Exception as e:
             print(f"❌ Error updating attendance batch: {e}")
             return False
@@ -348,14 +463,221 @@ class FirebaseManager:
 firebase_manager = None
 
 def get_firebase_manager() -> FirebaseManager:
-    """Get the global Firebase manager instance."""
+    """Get the global Firebase manager instance (created once, thread-safe)."""
     global firebase_manager
     if firebase_manager is None:
-        firebase_manager = FirebaseManager()
+        with _manager_lock:
+            if firebase_manager is None:
+                firebase_manager = FirebaseManager()
     return firebase_manager
 
 def initialize_firebase(service_account_path: str = "serviceAccountKey.json") -> FirebaseManager:
-    """Initialize Firebase and return the manager instance."""
+    """Eagerly initialize Firebase and return the shared manager instance.
+
+    Idempotent: repeated calls return the existing manager instead of
+    tearing down and recreating the gRPC channel.
+    """
     global firebase_manager
-    firebase_manager = FirebaseManager(service_account_path)
+    with _manager_lock:
+        if firebase_manager is None:
+            firebase_manager = FirebaseManager(service_account_path)
     return firebase_manager
+
+# Dedicated event loop for async Firestore work. The gRPC aio channel
+# inside AsyncClient binds to the event loop that first drives it, and
+# Flask would otherwise run each request in a fresh, short-lived loop —
+# so the client and one long-lived loop live together on a background
+# thread, and callers dispatch coroutines onto it with run_async().
+_async_loop = None
+
+def _get_async_loop():
+    """Return the long-lived loop thread's event loop, starting it once."""
+    global _async_loop
+    if _async_loop is None:
+        with _manager_lock:
+            if _async_loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="firestore-async", daemon=True).start()
+                _async_loop = loop
+    return _async_loop
+
+def run_async(coro):
+    """Run a coroutine on the dedicated Firestore loop and return its result.
+
+    Safe to call from any request thread; every async Firestore RPC goes
+    through the same loop the client's channel is bound to.
+    """
+    return asyncio.run_coroutine_threadsafe(coro, _get_async_loop()).result()
+
+
+class AsyncFirebaseManager:
+    """
+    Async read-side companion to FirebaseManager.
+
+    Wraps google-cloud-firestore's AsyncClient (via firebase_admin's
+    firestore_async) so independent reads can be issued concurrently with
+    asyncio.gather — an endpoint that needs a session document plus its
+    attendance records pays roughly one round-trip instead of their sum.
+    Writes stay on the sync manager.
+
+    Coroutines must run on the dedicated loop (use run_async from sync
+    code): the underlying gRPC channel is bound to that loop and would
+    fail with "attached to a different loop" anywhere else.
+    """
+
+    def __init__(self):
+        # Reuse the already-initialized Firebase app/credentials
+        get_firebase_manager()
+        from firebase_admin import firestore_async
+        self.db = firestore_async.client()
+
+    async def get_session_data(self, session_id: str) -> Optional[Dict]:
+        """Async variant of FirebaseManager.get_session_data."""
+        try:
+            doc = await self.db.collection('sessions').document(session_id).get()
+            if doc.exists:
+                data = doc.to_dict()
+                data['id'] = doc.id
+                return data
+            return None
+
+        except Exception as e:
+            print(f"❌ Error getting session data: {e}")
+            return None
+
+    async def get_session_with_attendance(self, session_id: str):
+        """
+        Fetch a session document and its attendance records.
+
+        The per-student attendance reads are fired concurrently with
+        asyncio.gather (record IDs are deterministic, so no query is
+        needed), overlapping their round-trips instead of paying them
+        one after another.
+
+        Returns:
+            (session dict or None, list of attendance records)
+        """
+        try:
+            session = await self.get_session_data(session_id)
+            if not session:
+                return None, []
+
+            class_id = session.get('classId')
+            start_time = session.get('startTime')
+            recognized_students = session.get('recognizedStudents', [])
+            if not (class_id and start_time):
+                return session, []
+
+            date_str = _session_date_str(start_time)
+            if recognized_students:
+                refs = [
+                    self.db.collection('attendance').document(f"{class_id}_{student_id}_{date_str}")
+                    for student_id in recognized_students
+                ]
+                docs = await asyncio.gather(*(ref.get() for ref in refs))
+                records = []
+                for doc in docs:
+                    if doc.exists:
+                        record = doc.to_dict()
+                        record['id'] = doc.id
+                        records.append(record)
+                return session, records
+
+            # No per-student IDs known — fall back to the sync class query
+            return session, list(get_firebase_manager().get_attendance_for_class(class_id, date_str))
+
+        except Exception as e:
+            print(f"❌ Error getting attendance for session: {e}")
+            return None, []
+
+
+# Async manager singleton (created lazily; shares the Firebase app)
+_async_firebase_manager = None
+
+def get_async_firebase_manager() -> AsyncFirebaseManager:
+    """Get the global async Firebase manager (created once, thread-safe)."""
+    global _async_firebase_manager
+    if _async_firebase_manager is None:
+        # Resolve the sync manager before taking the lock:
+        # AsyncFirebaseManager.__init__ calls get_firebase_manager(),
+        # which acquires the same non-reentrant lock when no sync
+        # manager exists yet — constructing under it would self-deadlock
+        get_firebase_manager()
+        with _manager_lock:
+            if _async_firebase_manager is None:
+                _async_firebase_manager = AsyncFirebaseManager()
+    return _async_firebase_manager
+
+# ---------------------------------------------------------
+# Write-behind buffer for single attendance records
+# ---------------------------------------------------------
+# save_attendance_record used to issue one blocking set() per call, so a
+# classroom of 60 students cost 60 sequential RPC round-trips on the
+# request path. Records now land in an in-process queue and one daemon
+# thread drains it in BulkWriter batches (up to 400 items or every
+# 100 ms), so enqueueing is effectively free and the aggregate write
+# rate scales with BulkWriter's parallel commits.
+_attendance_queue = queue.Queue()
+_ATTENDANCE_FLUSH_SIZE = 400
+_ATTENDANCE_FLUSH_INTERVAL = 0.1  # seconds
+_attendance_flusher_thread = None
+
+
+def _flush_attendance_items(items):
+    """Write one drained batch of (record_id, data) pairs via BulkWriter."""
+    if not items:
+        return
+    try:
+        db = get_firebase_manager().db
+        bulk = db.bulk_writer()
+        for record_id, attendance_data in items:
+            bulk.set(db.collection('attendance').document(record_id), attendance_data, merge=True)
+        bulk.close()
+    except Exception as e:
+        print(f"❌ Error flushing attendance buffer ({len(items)} records): {e}")
+
+
+def _attendance_flusher():
+    """Daemon loop: drain the queue in size- or time-bounded batches."""
+    while True:
+        items = [_attendance_queue.get()]
+        deadline = time.monotonic() + _ATTENDANCE_FLUSH_INTERVAL
+        while len(items) < _ATTENDANCE_FLUSH_SIZE:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                items.append(_attendance_queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        _flush_attendance_items(items)
+
+
+def _ensure_attendance_flusher():
+    """Start the flusher thread once, on first buffered record."""
+    global _attendance_flusher_thread
+    if _attendance_flusher_thread is None:
+        with _manager_lock:
+            if _attendance_flusher_thread is None:
+                _attendance_flusher_thread = threading.Thread(
+                    target=_attendance_flusher, name="attendance-flusher", daemon=True
+                )
+                _attendance_flusher_thread.start()
+
+
+def flush_attendance():
+    """Synchronously flush any still-buffered attendance records.
+
+    Registered atexit so records queued just before shutdown are not
+    lost when the daemon flusher thread is torn down.
+    """
+    items = []
+    try:
+        while True:
+            items.append(_attendance_queue.get_nowait())
+    except queue.Empty:
+        pass
+    _flush_attendance_items(items)
+
+
+atexit.register(flush_attendance)
@@ -1,145 +1,636 @@
 import cv2
+import json
 import pickle
 import numpy as np
 from deepface import DeepFace
-from sklearn.metrics.pairwise import cosine_similarity
+import atexit
 import os
 import csv
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
 from datetime import datetime
 from flask import jsonify
-from firebase_config import get_firebase_manager
+from firebase_config import get_firebase_manager, initialize_firebase
+
+try:
+    import faiss  # optional: ANN index built by EncodeGenerator
+except ImportError:
+    faiss = None
+
+try:
+    import torch  # optional: GPU gallery scoring when CUDA is present
+    _TORCH_CUDA = torch.cuda.is_available()
+except ImportError:
+    torch = None
+    _TORCH_CUDA = False
+
+try:
+    import orjson  # optional: faster names.json decode
+except ImportError:
+    orjson = None
+
+try:
+    from numba import njit, prange  # optional: JIT CPU scoring kernel
+except ImportError:
+    njit = None
 
 # Configuration
-EMBEDDINGS_PATH = "embeddings.pkl"
+EMBEDDINGS_PATH = "embeddings.dat"
+EMBEDDINGS_INDEX_PATH = "embeddings.index.json"
+LEGACY_NPZ_PATH = "embeddings.npz"
+LEGACY_EMBEDDINGS_PATH = "embeddings.pkl"
+PCA_PATH = "gallery_pca.npz"
+GALLERY_NPY_PATH = "gallery.npy"
+GALLERY_NAMES_PATH = "names.json"
+FAISS_INDEX_PATH = "embeddings.faiss"
+FAISS_NAMES_PATH = "embeddings.faiss.names.json"
+EMB_DIM = 512
 SIMILARITY_THRESHOLD = 0.6
+# Opt-in int8 gallery scoring: quarters the memory the CPU matmul moves
+# (vs fp32) at a sub-threshold accuracy cost; fp16 stays the default
+USE_INT8_GALLERY = os.getenv("GALLERY_INT8", "0") == "1"
 MODEL_NAME = "ArcFace"
 ATTENDANCE_THRESHOLD = 0.25  # 25%
-MODEL_PATH_YUNET = 'face_detection_yunet_2023mar.onnx'  
+# Legacy CSV output is opt-in: Firebase is the source of truth, so the
+# extra file I/O per session is skipped unless explicitly requested
+WRITE_CSV = os.getenv("ATTENDANCE_WRITE_CSV", "0") == "1"
+MODEL_PATH_YUNET = 'face_detection_yunet_2023mar.onnx'
+ARCFACE_INPUT_SIZE = (112, 112)
+DETECTOR_INPUT_SIZE = (640, 480)  # fixed (width, height) detector input
+
+# Load face detector pinned to one input size; incoming frames are
+# letterboxed to it instead of resizing the detector per request
+DETECTOR = cv2.FaceDetectorYN.create(MODEL_PATH_YUNET, "", DETECTOR_INPUT_SIZE)
+
+def _letterbox(frame):
+    """Resize + zero-pad a frame to the fixed detector input.
+
+    Returns (padded, scale); detections on the padded image map back to
+    original coordinates by dividing by scale.
+    """
+    in_w, in_h = DETECTOR_INPUT_SIZE
+    h, w = frame.shape[:2]
+    scale = min(in_w / w, in_h / h)
+    new_w, new_h = int(round(w * scale)), int(round(h * scale))
+    padded = np.zeros((in_h, in_w, 3), dtype=frame.dtype)
+    padded[:new_h, :new_w] = cv2.resize(frame, (new_w, new_h))
+    return padded, scale
+
+# Set up the shared Firestore client at import rather than on the first
+# save: the gRPC channel/TLS handshake is expensive and the client is
+# thread-safe, so one eager instance serves the whole process
+try:
+    initialize_firebase()
+except Exception as e:
+    print(f"⚠️ Firebase not initialized at import: {e}")
+
+# Shared pool for the independent end-of-session writes (CSV + Firestore)
+_save_executor = ThreadPoolExecutor(max_workers=4)
+
+# ---------------------------
+# Background CSV writer
+# ---------------------------
+# Attendance rows are queued and written by one daemon thread that keeps
+# each CSV open with a large buffer, so the request path never opens a
+# file or waits on a write syscall; the buffer is flushed every few rows
+# or every second, whichever comes first.
+CSV_HEADER = ["Name", "Presence (s)", "Session Duration (s)", "Attendance (%)", "Status", "Start", "End"]
+_csv_queue = queue.Queue()
+_CSV_FLUSH_ROWS = 64
+_CSV_FLUSH_INTERVAL = 1.0  # seconds
+_csv_files = {}  # filename -> (handle, csv.writer), owned by the writer thread
+_csv_thread = None
+_csv_thread_lock = threading.Lock()
+
+def _csv_writer_loop():
+    """Daemon loop: append queued rows, flushing on size or time bounds."""
+    pending = 0
+    last_flush = time.monotonic()
+    while True:
+        try:
+            filename, row = _csv_queue.get(timeout=_CSV_FLUSH_INTERVAL)
+        except queue.Empty:
+            filename = None
+        if filename is not None:
+            # One bad row (e.g. an unopenable filename) must not kill the
+            # writer thread or leave the queue un-acknowledged — flush_csv's
+            # join() would then hang shutdown
+            try:
+                if filename not in _csv_files:
+                    is_new = not os.path.isfile(filename)
+                    f = open(filename, "a", newline="", buffering=1 << 20)
+                    writer = csv.writer(f)
+                    if is_new:
+                        writer.writerow(CSV_HEADER)
+                    _csv_files[filename] = (f, writer)
+                _csv_files[filename][1].writerow(row)
+                pending += 1
+            except Exception as e:
+                print(f"❌ Error writing attendance CSV row to {filename}: {e}")
+            finally:
+                _csv_queue.task_done()
+        now = time.monotonic()
+        if pending and (pending >= _CSV_FLUSH_ROWS or now - last_flush >= _CSV_FLUSH_INTERVAL):
+            for f, _ in _csv_files.values():
+                f.flush()
+            pending = 0
+            last_flush = now
+
+def _enqueue_csv_row(filename, row):
+    """Hand one row to the background writer, starting it on first use."""
+    global _csv_thread
+    if _csv_thread is None:
+        with _csv_thread_lock:
+            if _csv_thread is None:
+                _csv_thread = threading.Thread(target=_csv_writer_loop, name="csv-writer", daemon=True)
+                _csv_thread.start()
+    _csv_queue.put((filename, row))
+
+def flush_csv():
+    """Drain queued rows and flush file buffers (registered atexit)."""
+    if _csv_thread is not None:
+        _csv_queue.join()
+        for f, _ in _csv_files.values():
+            f.flush()
 
-# Load face detector
-DETECTOR = cv2.FaceDetectorYN.create(MODEL_PATH_YUNET, "", (320, 320))
+atexit.register(flush_csv)
+
+# Process-wide ArcFace model (DeepFace.build_model memoizes the weights,
+# so this also shares the instance with EncodeGenerator)
+_arcface_model = None
+
+def get_arcface_model():
+    """Return the ArcFace Keras model, building it on first use.
+
+    On GPU hosts the model is built under Keras' mixed_float16 policy so
+    inference runs in fp16 on tensor cores; CPU hosts keep fp32.
+    """
+    global _arcface_model
+    if _arcface_model is None:
+        from EncodeGenerator import enable_mixed_precision
+        enable_mixed_precision()
+        _arcface_model = DeepFace.build_model(MODEL_NAME)
+    return _arcface_model
 
 # ---------------------------
 # Utility Functions
 # ---------------------------
 
 def load_embeddings():
-    """Load stored face embeddings from file."""
-    with open(EMBEDDINGS_PATH, "rb") as f:
+    """Load stored face embeddings from file.
+
+    Reads the raw memory-mapped matrix + index sidecar written by
+    EncodeGenerator; falls back to the packed .npz and then the legacy
+    pickle for old deployments.
+    """
+    if os.path.exists(EMBEDDINGS_PATH) and os.path.exists(EMBEDDINGS_INDEX_PATH):
+        with open(EMBEDDINGS_INDEX_PATH, "r") as f:
+            index = json.load(f)
+        if index.get("rows"):
+            emb = np.memmap(EMBEDDINGS_PATH, dtype=np.float32, mode="r").reshape(-1, index.get("dim", EMB_DIM))
+            return {
+                person: [np.asarray(emb[i], dtype=np.float32) for i in range(start, stop)]
+                for person, (start, stop) in index["people"].items()
+            }
+        return {}
+    if os.path.exists(LEGACY_NPZ_PATH):
+        data = np.load(LEGACY_NPZ_PATH, mmap_mode="r", allow_pickle=True)
+        embeddings_db = {}
+        for row, name in zip(data["emb"], data["names"]):
+            embeddings_db.setdefault(str(name), []).append(np.asarray(row, dtype=np.float32))
+        return embeddings_db
+    with open(LEGACY_EMBEDDINGS_PATH, "rb") as f:
         return pickle.load(f)
 
-def find_match(face_embedding, embeddings_db):
-    """Find the best match for a given face embedding."""
-    best_match = "Unknown"
-    best_score = 0
-    
-    for person, person_embeddings in embeddings_db.items():
-        for stored_embedding in person_embeddings:
-            similarity = cosine_similarity([face_embedding], [stored_embedding])[0][0]
-            if similarity > best_score:
-                best_score = similarity
-                best_match = person
-    
-    return (best_match, best_score) if best_score >= SIMILARITY_THRESHOLD else ("Unknown", best_score)
+# FAISS index cache, reloaded when EncodeGenerator rewrites the artifact
+_faiss_cache = {"mtime": None, "index": None, "names": None}
+
+def _load_faiss_index():
+    """Return (index, names) when faiss and its index artifact are available,
+    else None. The loaded index is cached and refreshed on file mtime."""
+    if faiss is None:
+        return None
+    if not (os.path.exists(FAISS_INDEX_PATH) and os.path.exists(FAISS_NAMES_PATH)):
+        return None
+
+    mtime = os.path.getmtime(FAISS_INDEX_PATH)
+    if _faiss_cache["mtime"] != mtime:
+        _faiss_cache["index"] = faiss.read_index(FAISS_INDEX_PATH)
+        with open(FAISS_NAMES_PATH, "r") as f:
+            _faiss_cache["names"] = json.load(f)
+        _faiss_cache["mtime"] = mtime
+    return _faiss_cache["index"], _faiss_cache["names"]
+
+def _load_pca():
+    """Load the 512-D -> 128-D projection written by EncodeGenerator, if any."""
+    if os.path.exists(PCA_PATH):
+        data = np.load(PCA_PATH)
+        return data["mean"].astype(np.float32), data["components"].astype(np.float32)
+    return None
+
+def load_gallery():
+    """Load the stored embeddings as an L2-normalized float16 matrix plus a
+    parallel names array.
+
+    When a PCA projection is available, stored rows are projected to 128-D
+    first, quartering the memory the scoring matmul moves. Rows are
+    normalized once here, so cosine similarity against the whole gallery
+    reduces to a single matrix-vector product; float16 halves the memory
+    traffic of that product and perturbs scores well below the
+    match-threshold margin.
+    """
+    pca = _load_pca()
+
+    # Prefer the prebuilt flat gallery (see build_gallery.py): a
+    # memory-mapped .npy plus a JSON name list loads without
+    # reconstructing a dict-of-lists object graph. np.array forces a
+    # writable copy — the mmap is read-only and the normalization below
+    # runs in place
+    if os.path.exists(GALLERY_NPY_PATH) and os.path.exists(GALLERY_NAMES_PATH):
+        E = np.array(np.load(GALLERY_NPY_PATH, mmap_mode="r"), dtype=np.float32)
+        with open(GALLERY_NAMES_PATH, "rb") as f:
+            raw = f.read()
+        names = orjson.loads(raw) if orjson is not None else json.loads(raw)
+    else:
+        embeddings_db = load_embeddings()
+        names, rows = [], []
+        for person, person_embeddings in embeddings_db.items():
+            for stored_embedding in person_embeddings:
+                rows.append(np.asarray(stored_embedding, dtype=np.float32))
+                names.append(person)
+        E = np.vstack(rows) if rows else None
+
+    if E is None or E.shape[0] == 0:
+        return np.empty((0, EMB_DIM), dtype=np.float16), np.array([], dtype=object), pca, None
+    if pca is not None:
+        mean, components = pca
+        E = (E - mean) @ components.T
+    E /= (np.linalg.norm(E, axis=1, keepdims=True) + 1e-12)
+
+    quant = None
+    if USE_INT8_GALLERY:
+        # Per-row symmetric quantization: int8 codes plus a float scale
+        # per row, dequantized after the integer matmul
+        row_max = np.abs(E).max(axis=1, keepdims=True) + 1e-12
+        Eq = np.round(E / row_max * 127.0).astype(np.int8)
+        quant = (Eq, (row_max[:, 0] / 127.0).astype(np.float32))
+
+    return E.astype(np.float16), np.array(names, dtype=object), pca, quant
+
+# In-process gallery cache so recognition requests don't re-read and
+# re-normalize the store every call; keyed on store-file mtimes so a
+# rebuild (from this process or another) is picked up automatically
+_gallery_cache = {"stamp": None, "data": None}
+_gallery_lock = threading.Lock()
+
+def _gallery_stamp():
+    """mtimes of every artifact the serving gallery is derived from."""
+    return tuple(
+        os.path.getmtime(path) if os.path.exists(path) else None
+        for path in (GALLERY_NPY_PATH, GALLERY_NAMES_PATH, EMBEDDINGS_PATH,
+                     EMBEDDINGS_INDEX_PATH, LEGACY_NPZ_PATH,
+                     LEGACY_EMBEDDINGS_PATH, PCA_PATH)
+    )
+
+def get_gallery():
+    """Return the serving gallery, reloading only when the store changed.
+
+    A few cheap stat calls per request replace the unconditional
+    re-read + re-normalize; the lock keeps concurrent Flask workers from
+    double-loading after an update.
+    """
+    stamp = _gallery_stamp()
+    with _gallery_lock:
+        if _gallery_cache["data"] is None or _gallery_cache["stamp"] != stamp:
+            _gallery_cache["data"] = load_gallery()
+            _gallery_cache["stamp"] = stamp
+        return _gallery_cache["data"]
+
+def invalidate_gallery_cache():
+    """Force the next get_gallery call to reload from disk."""
+    with _gallery_lock:
+        _gallery_cache["data"] = None
+        _gallery_cache["stamp"] = None
+
+# Optional Numba kernel for single-query CPU scoring: a fused
+# parallel dot-product over gallery rows skips BLAS dispatch overhead,
+# which dominates GEMV at this row width. Compiled (or loaded from the
+# on-disk cache) at import via a dummy call so the first request never
+# pays the JIT.
+_score_rows = None
+if njit is not None:
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _score_rows(E, q):
+        out = np.empty(E.shape[0], np.float32)
+        for i in prange(E.shape[0]):
+            s = 0.0
+            for j in range(E.shape[1]):
+                s += E[i, j] * q[j]
+            out[i] = s
+        return out
+
+    try:
+        _score_rows(np.zeros((1, EMB_DIM), dtype=np.float32), np.zeros(EMB_DIM, dtype=np.float32))
+    except Exception as e:
+        print(f"⚠️ Numba scoring kernel unavailable: {e}")
+        _score_rows = None
+
+# float32 copy of the gallery for the Numba kernel (numba has no fp16
+# arithmetic); rebuilt only when the cached gallery matrix rotates. The
+# source array is held as the cache key (identity compare) so a reloaded
+# gallery can never alias a freed matrix's id and get the stale copy.
+_numba_gallery = {"source": None, "matrix": None}
+
+def _gallery_for_numba(E):
+    """Return a contiguous float32 view of the gallery for _score_rows,
+    or None when the kernel is unavailable or the gallery is empty."""
+    if _score_rows is None or E.shape[0] == 0:
+        return None
+    if _numba_gallery["source"] is not E:
+        _numba_gallery["matrix"] = np.ascontiguousarray(E, dtype=np.float32)
+        _numba_gallery["source"] = E
+    return _numba_gallery["matrix"]
+
+# Persistent CUDA copy of the gallery matrix; re-uploaded only when
+# get_gallery hands out a new matrix, so each request transfers just the
+# few-KB query over PCIe. The source array itself is kept as the cache
+# key (identity compare): keeping it alive means a reloaded gallery can
+# never alias a freed matrix's id and be served the stale tensor.
+_gpu_gallery = {"source": None, "tensor": None}
+
+def _gallery_on_gpu(E):
+    """Return the gallery as a resident float16 CUDA tensor, or None
+    when torch/CUDA are unavailable or the gallery is empty."""
+    if not _TORCH_CUDA or E.shape[0] == 0:
+        return None
+    if _gpu_gallery["source"] is not E:
+        _gpu_gallery["tensor"] = torch.from_numpy(np.ascontiguousarray(E)).cuda()
+        _gpu_gallery["source"] = E
+    return _gpu_gallery["tensor"]
+
+def find_match(face_embedding, gallery):
+    """Find the best match for a given face embedding.
+
+    One matmul against the normalized gallery scores every stored
+    embedding at once instead of a Python loop over persons. The query is
+    pushed through the same PCA projection as the stored rows, if one is
+    loaded.
+    """
+    E, names, pca, quant = gallery
+    if E.shape[0] == 0:
+        return ("Unknown", 0.0)
+
+    q = np.asarray(face_embedding, dtype=np.float32)
+    if pca is not None:
+        mean, components = pca
+        q = (q - mean) @ components.T
+    q /= (np.linalg.norm(q) + 1e-12)
+
+    # Prefer the FAISS index (SIMD inner-product kernels, O(log N) for ANN
+    # variants) when it exists and matches the query dimensionality
+    hit = _load_faiss_index()
+    if hit is not None:
+        index, index_names = hit
+        if index.d == q.shape[0]:
+            D, I = index.search(np.ascontiguousarray(q, dtype=np.float32)[None, :], 1)
+            best_score = float(D[0][0])
+            name = index_names[int(I[0][0])]
+            return (name, best_score) if best_score >= SIMILARITY_THRESHOLD else ("Unknown", best_score)
+
+    # GPU path: single cuBLAS matvec against the resident gallery tensor
+    G = _gallery_on_gpu(E)
+    if G is not None:
+        s = G @ torch.from_numpy(q.astype(np.float16)).cuda()
+        v, i = s.max(0)
+        best_score, best = float(v), int(i)
+    elif quant is not None:
+        Eq, row_scales = quant
+        q_scale = float(np.abs(q).max()) + 1e-12
+        q8 = np.round(q / q_scale * 127.0).clip(-128, 127).astype(np.int8)
+        scores = (Eq.astype(np.int32) @ q8.astype(np.int32)).astype(np.float32)
+        scores *= row_scales * (q_scale / 127.0)
+        best = int(scores.argmax())
+        best_score = float(scores[best])
+    else:
+        Ef = _gallery_for_numba(E)
+        if Ef is not None:
+            scores = _score_rows(Ef, q)
+        else:
+            scores = E @ q.astype(np.float16)
+        best = int(scores.argmax())
+        best_score = float(scores[best])
+
+    return (names[best], best_score) if best_score >= SIMILARITY_THRESHOLD else ("Unknown", best_score)
+
+def find_match_batch(face_embeddings, gallery):
+    """Match a (F, D) batch of face embeddings in one shot.
+
+    All faces are scored against all identities with a single
+    matrix-matrix product (or one FAISS search), instead of one matmul
+    per face. Returns a list of (name, score) tuples in input order.
+    """
+    E, names, pca, quant = gallery
+
+    Q = np.asarray(face_embeddings, dtype=np.float32)
+    if pca is not None:
+        mean, components = pca
+        Q = (Q - mean) @ components.T
+    Q /= (np.linalg.norm(Q, axis=1, keepdims=True) + 1e-12)
+
+    if E.shape[0] == 0:
+        return [("Unknown", 0.0)] * Q.shape[0]
+
+    hit = _load_faiss_index()
+    if hit is not None:
+        index, index_names = hit
+        if index.d == Q.shape[1]:
+            D, I = index.search(np.ascontiguousarray(Q, dtype=np.float32), 1)
+            return [
+                (index_names[int(i)], float(d)) if d >= SIMILARITY_THRESHOLD else ("Unknown", float(d))
+                for d, i in zip(D[:, 0], I[:, 0])
+            ]
+
+    G = _gallery_on_gpu(E)
+    if G is not None:
+        s = torch.from_numpy(Q.astype(np.float16)).cuda() @ G.T
+        v, i = s.max(dim=1)
+        idx = i.cpu().numpy()
+        scores = v.float().cpu().numpy()
+    elif quant is not None:
+        Eq, row_scales = quant
+        q_scales = np.abs(Q).max(axis=1, keepdims=True) + 1e-12
+        Q8 = np.round(Q / q_scales * 127.0).clip(-128, 127).astype(np.int8)
+        S = (Q8.astype(np.int32) @ Eq.T.astype(np.int32)).astype(np.float32)
+        S *= (q_scales / 127.0) * row_scales[None, :]
+        idx = S.argmax(axis=1)
+        scores = S[np.arange(S.shape[0]), idx]
+    else:
+        S = Q.astype(np.float16) @ E.T
+        idx = S.argmax(axis=1)
+        scores = S[np.arange(S.shape[0]), idx]
+    return [
+        (names[int(i)], float(s)) if s >= SIMILARITY_THRESHOLD else ("Unknown", float(s))
+        for i, s in zip(idx, scores)
+    ]
 
 def save_attendance(attendance, session_name, session_start, session_end, session_length, class_id="default"):
-    """Save attendance data to CSV and Firebase."""
-    # Save to CSV (legacy support)
-    filename = f"attendance_{session_name}.csv"
-    file_exists = os.path.isfile(filename)
-
-    with open(filename, "a", newline="") as f:
-        writer = csv.writer(f)
-        if not file_exists:
-            writer.writerow(["Name", "Presence (s)", "Session Duration (s)", "Attendance (%)", "Status", "Start", "End"])
-        
-        for person, presence_time in attendance.items():
-            percentage = presence_time / session_length
-            status = "Present" if percentage >= ATTENDANCE_THRESHOLD else "Absent"
-            writer.writerow([
-                person, round(presence_time, 2), session_length,
-                f"{percentage*100:.1f}%", status,
-                session_start.strftime("%Y-%m-%d %H:%M:%S"),
-                session_end.strftime("%Y-%m-%d %H:%M:%S")
+    """Save attendance data to CSV and Firebase.
+
+    CSV rows go to the background writer thread (legacy support), and the
+    Firestore attendance batch and session document run concurrently on a
+    shared executor — wall time is the slowest write instead of their sum.
+    """
+
+    # Percentages and statuses are computed once, vectorized, and shared
+    # by the CSV rows and the Firebase records instead of redoing the
+    # arithmetic per student per sink
+    names = list(attendance.keys())
+    times = np.fromiter(attendance.values(), dtype=np.float64, count=len(names))
+    pct = times / session_length
+    present_mask = pct >= ATTENDANCE_THRESHOLD
+
+    if WRITE_CSV:
+        # Save to CSV (legacy support) via the background writer
+        filename = f"attendance_{session_name}.csv"
+        start_str = session_start.strftime("%Y-%m-%d %H:%M:%S")
+        end_str = session_end.strftime("%Y-%m-%d %H:%M:%S")
+        for person, presence_time, percentage, present in zip(names, times, pct, present_mask):
+            _enqueue_csv_row(filename, [
+                person, round(float(presence_time), 2), session_length,
+                f"{percentage*100:.1f}%", "Present" if present else "Absent",
+                start_str, end_str
             ])
-    
-    # Save to Firebase
+
+    futures = {}
+
     try:
         firebase_manager = get_firebase_manager()
-        if firebase_manager:
-            # Prepare attendance records for Firebase
-            attendance_records = {}
-            for person, presence_time in attendance.items():
-                percentage = presence_time / session_length
-                attendance_records[person] = {
-                    'status': "present" if percentage >= ATTENDANCE_THRESHOLD else "absent",
-                    'presence_time': presence_time,
-                    'attendance_percentage': percentage * 100,
-                    'session_duration': session_length
-                }
-            
-            # Save batch attendance records
-            firebase_manager.update_attendance_batch(class_id, attendance_records)
-            
-            # Save session data
-            session_id = f"{class_id}_{session_name}_{session_start.strftime('%Y%m%d_%H%M%S')}"
-            firebase_manager.save_session_data(
-                session_id=session_id,
-                session_name=session_name,
-                start_time=session_start,
-                end_time=session_end,
-                duration_minutes=session_length // 60,
-                recognized_students=list(attendance.keys()),
-                class_id=class_id  # Added for transcript/summary/quiz integration
-            )
-            print(f"✅ Attendance data saved to Firebase for session: {session_name}")
-        else:
-            print("⚠️ Firebase not available, only CSV saved")
     except Exception as e:
         print(f"❌ Error saving to Firebase: {e}")
-        # Continue execution even if Firebase fails
+        firebase_manager = None
+
+    if firebase_manager:
+        # Prepare attendance records for Firebase from the same arrays
+        attendance_records = {
+            person: {
+                'status': "present" if present else "absent",
+                'presence_time': float(presence_time),
+                'attendance_percentage': float(percentage) * 100,
+                'session_duration': session_length
+            }
+            for person, presence_time, percentage, present in zip(names, times, pct, present_mask)
+        }
+
+        session_id = f"{class_id}_{session_name}_{session_start.strftime('%Y%m%d_%H%M%S')}"
+
+        futures["firebase_batch"] = _save_executor.submit(
+            firebase_manager.update_attendance_batch, class_id, attendance_records
+        )
+        futures["firebase_session"] = _save_executor.submit(
+            firebase_manager.save_session_data,
+            session_id=session_id,
+            session_name=session_name,
+            start_time=session_start,
+            end_time=session_end,
+            duration_minutes=session_length // 60,
+            recognized_students=names,
+            class_id=class_id  # Added for transcript/summary/quiz integration
+        )
+    else:
+        if WRITE_CSV:
+            print("⚠️ Firebase not available, only CSV saved")
+        else:
+            print("⚠️ Firebase not available and CSV output disabled — attendance not persisted")
+
+    wait(list(futures.values()))
+
+    failed = False
+    for name, future in futures.items():
+        exc = future.exception()
+        if exc is not None:
+            print(f"❌ Error in {name} save: {exc}")
+            failed = True
+
+    if firebase_manager and not failed:
+        print(f"✅ Attendance data saved to Firebase for session: {session_name}")
 
 # ---------------------------
 # API-Ready Core Logic
 # ---------------------------
 
-def recognize_faces_from_image(image_path):
+def recognize_faces_core(frame):
     """
-    Detect and recognize faces from an uploaded image.
-    Returns JSON with recognized faces and confidence scores.
+    Detect and recognize faces in an already-decoded BGR image array.
+    Core form: returns a plain dict with recognized faces and confidence
+    scores; only route-level wrappers serialize to a Flask response.
     """
-    embeddings_db = load_embeddings()
-    
-    frame = cv2.imread(image_path)
+    gallery = get_gallery()
+
     if frame is None:
-        return jsonify({"status": "error", "message": "Invalid image file"}), 400
+        return {"status": "error", "message": "Invalid image file"}
 
-    DETECTOR.setInputSize((frame.shape[1], frame.shape[0]))
-    _, faces = DETECTOR.detect(frame)
+    # Detect on a letterboxed copy so the detector input size never changes,
+    # then map boxes back to the original frame before cropping
+    padded, scale = _letterbox(frame)
+    _, faces = DETECTOR.detect(padded)
 
     results = []
-    
+
     if faces is not None:
+        # Gather all crops first, then run one batched forward pass and one
+        # batched gallery match instead of a model call per face
+        rois, bboxes = [], []
         for face in faces:
-            x, y, w, h = map(int, face[:4])
-            face_img = frame[y:y+h, x:x+w]
+            x, y, w, h = (int(v / scale) for v in face[:4])
+            x, y = max(x, 0), max(y, 0)
+            try:
+                face_img = frame[y:y+h, x:x+w]
+                if face_img.size == 0:
+                    raise ValueError("empty face crop")
+                rois.append(face_img)
+                bboxes.append([x, y, w, h])
+            except Exception as e:
+                results.append({"error": str(e)})
 
+        if rois:
             try:
-                embedding = DeepFace.represent(face_img, model_name=MODEL_NAME, enforce_detection=False)[0]["embedding"]
-                name, confidence = find_match(embedding, embeddings_db)
-                results.append({
-                    "name": name,
-                    "confidence": round(float(confidence), 3),
-                    "bounding_box": [x, y, w, h]
-                })
+                # Resize every crop into one preallocated buffer instead of
+                # allocating per face, then normalize the batch in one pass
+                batch_u8 = np.empty((len(rois),) + ARCFACE_INPUT_SIZE + (3,), dtype=np.uint8)
+                for i, roi in enumerate(rois):
+                    cv2.resize(roi, ARCFACE_INPUT_SIZE, dst=batch_u8[i])
+                batch = batch_u8.astype(np.float32) / 255.0
+                embeddings = get_arcface_model().predict(batch, verbose=0)
+                for (name, confidence), bbox in zip(find_match_batch(embeddings, gallery), bboxes):
+                    results.append({
+                        "name": name,
+                        "confidence": round(float(confidence), 3),
+                        "bounding_box": bbox
+                    })
             except Exception as e:
                 results.append({"error": str(e)})
 
-    return jsonify({
+    return {
         "status": "success",
         "faces_detected": len(results),
         "results": results
-    })
+    }
+
+def recognize_faces_from_array(frame):
+    """Flask wrapper around recognize_faces_core."""
+    result = recognize_faces_core(frame)
+    if result["status"] == "error":
+        return jsonify(result), 400
+    return jsonify(result)
+
+def recognize_faces_from_image(image_path):
+    """
+    Detect and recognize faces from an uploaded image file.
+    Returns JSON with recognized faces and confidence scores.
+    """
+    return recognize_faces_from_array(cv2.imread(image_path))
 
 def mark_attendance(session_name, attendance_data, session_duration, class_id="default"):
     """
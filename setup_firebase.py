@@ -6,7 +6,7 @@ This script helps you set up Firebase configuration and test the connection.
 
 import os
 import json
-from firebase_config import initialize_firebase
+from firebase_config import initialize_firebase, flush_attendance
 
 def setup_firebase():
     """Setup Firebase configuration."""
@@ -71,8 +71,10 @@ def setup_firebase():
         else:
             print("❌ Failed to save test attendance record")
         
-        # Test getting attendance records
-        records = firebase_manager.get_attendance_for_class("test_class")
+        # Test getting attendance records — saving is write-behind, so
+        # force the buffer out before reading back
+        flush_attendance()
+        records = list(firebase_manager.get_attendance_for_class("test_class"))
         print(f"✅ Retrieved {len(records)} attendance records")
         
         print("\n🎉 Firebase setup completed successfully!")